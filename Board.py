@@ -1,4 +1,16 @@
+from functools import lru_cache
 from math import inf
+from random import getrandbits
+
+# NumPy is optional and is only used by leaf_utilities() (which requires
+# np.bitwise_count() from NumPy 2.0).
+try:
+    import numpy as np
+except ImportError:
+    np = None
+else:
+    if not hasattr(np, "bitwise_count"):
+        np = None
 
 
 # Square value constants
@@ -9,24 +21,190 @@ OPEN = "-"
 BLOCKED = "/"
 
 
-# Evaluation function for non-terminal leaf nodes
+# Bitboards
+
+# A board's squares are stored as int bitboards, where bit row * width + col
+# (the square's flat index) is set if the square at (row, col) is in the set
+# the bitboard represents. Python ints have no fixed size, so any board size
+# works, though all supported sizes fit in 64 bits.
+
+_NEIGHBOR_MASKS = {} # (width, height) -> neighbor masks, indexed by flat index
+
+# Return a list where the element at each flat index of a width x height board
+# is a bitboard of the (up to 9) squares in the 3x3 neighborhood centered on
+# that square, including the square itself (i.e., the squares that become
+# unavailable when that square is played). Each list is built once.
+def neighbor_masks(width, height):
+    masks = _NEIGHBOR_MASKS.get((width, height))
+    if masks is None:
+        masks = _NEIGHBOR_MASKS[(width, height)] = [
+            sum(
+                1 << (r * width + c)
+                for r in range(max(0, row - 1), min(height, row + 2))
+                for c in range(max(0, col - 1), min(width, col + 2))
+            )
+            for row in range(height) for col in range(width)
+        ]
+    return masks
+
+# Yield the flat indices of the set bits of bitboard in increasing order.
+def _bits(bitboard):
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+
+# Zobrist hashing
+
+# A board's hash is the XOR of a random 64-bit key for each non-open square
+# (chosen by the square's position and value) and, if it is MIN's turn, of
+# _ZOBRIST_TURN. This lets place() update the hash with one XOR per changed
+# square instead of rehashing the whole board.
+# Rotating or reflecting a board does not change its utility, so each board
+# also keeps the hash it would have under each of the board's symmetries, and
+# the smallest of these is used as the board's key. This way, all symmetric
+# positions share one key.
+_ZOBRIST_TURN = getrandbits(64)
+_ZOBRIST_KEYS = {} # (width, height) -> per-square keys, indexed by flat index
+
+# Indices of each square's keys for each non-open square value
+_BLOCKED_KEY = 0
+_MAX_KEY = 1
+_MIN_KEY = 2
+
+# Return the keys for each square of a width x height board, where
+# keys[idx][value] is the key for the square at flat index idx holding value
+# (one of the key indices above).
+def _zobrist_keys(width, height):
+    keys = _ZOBRIST_KEYS.get((width, height))
+    if keys is None:
+        keys = _ZOBRIST_KEYS[(width, height)] = [
+            (getrandbits(64), getrandbits(64), getrandbits(64))
+            for _ in range(width * height)
+        ]
+    return keys
+
+_SYMMETRIES = {} # (width, height) -> symmetry permutations
+
+# Return a list of the symmetries of a width x height board (4 for rectangular
+# boards and 8 for square boards, starting with the identity), each as a tuple
+# giving the flat index that each flat index is moved to by the symmetry.
+def _symmetries(width, height):
+    perms = _SYMMETRIES.get((width, height))
+    if perms is None:
+        # Each transform maps (row, col) to a new (row, col).
+        last_row, last_col = height - 1, width - 1
+        transforms = [
+            lambda r, c: (r, c), # Identity
+            lambda r, c: (r, last_col - c), # Mirror left/right
+            lambda r, c: (last_row - r, c), # Mirror top/bottom
+            lambda r, c: (last_row - r, last_col - c) # Rotate 180 degrees
+        ]
+        if width == height:
+            transforms += [
+                lambda r, c: (c, r), # Mirror along the main diagonal
+                lambda r, c: (c, last_row - r), # Rotate 90 degrees
+                lambda r, c: (last_col - c, r), # Rotate 270 degrees
+                lambda r, c: (last_col - c, last_row - r) # Anti-diagonal
+            ]
+        
+        perms = _SYMMETRIES[(width, height)] = [
+            tuple(
+                row * width + col for row, col in (
+                    transform(r, c) for r in range(height)
+                    for c in range(width)
+                )
+            )
+            for transform in transforms
+        ]
+    return perms
+
+_BOARD_TABLES = {} # (width, height) -> tables used by place_flat()
+
+# Return the (neighbor masks, keys, symmetries, inverses) tables for a
+# width x height board, where keys[sym][idx] is _zobrist_keys()[perm[idx]] for
+# the permutation perm of symmetry sym, so that place_flat() can update the
+# hash under each symmetry without going through the permutations, and
+# inverses[sym] is the inverse permutation of perm. Every board keeps a
+# reference to its size's tables, so they are looked up only once per game.
+def _board_tables(width, height):
+    tables = _BOARD_TABLES.get((width, height))
+    if tables is None:
+        keys = _zobrist_keys(width, height)
+        perms = _symmetries(width, height)
+        tables = _BOARD_TABLES[(width, height)] = (
+            neighbor_masks(width, height),
+            [[keys[i] for i in perm] for perm in perms],
+            perms,
+            [
+                tuple(perm.index(idx) for idx in range(width * height))
+                for perm in perms
+            ]
+        )
+    return tables
+
+
+# Evaluation function for leaf nodes
 
-# Prefer moves that leave the fewest open squares for the opponent at this
-# state, unless that would leave only a single square and thus result in a
-# definite loss. Other situations may lead to a definite loss, but they require
-# more than the open count to identify.
-# Conversely, when the leaf utility comes from a node where the other player
-# chooses, this results in preferring moves that result in the most options for
-# yourself for any given leaf node.
-def _evaluate_node(board):
-    util = board._open_cnt
-    if util == 1: # Avoid leaving exactly 1 open square
-        util = board.width * board.height + 1 # Greater than open count for all states
+# Return the utility of a leaf node with the open squares in open_bb if it is
+# MAX's turn; the utility if it is MIN's turn is the negation of this.
+# Leaf positions often converge onto the same few sets of open squares, so the
+# results are cached by open_bb (and the board size's penalty).
+@lru_cache(maxsize=1 << 20)
+def _leaf_eval(open_bb, penalty):
+    # The utility value of a terminal node is -infinity if it is MAX's turn
+    # because MIN (the player without the current turn) won.
+    cnt = open_bb.bit_count()
+    if cnt == 0:
+        return -inf
     
+    # Otherwise, it is the value of the evaluation function for non-terminal
+    # leaf nodes:
+    # Prefer moves that leave the fewest open squares for the opponent at this
+    # state, unless that would leave only a single square and thus result in a
+    # definite loss, so that case gets the penalty (width * height + 1, which
+    # is greater than the open count for all states). Other situations may lead
+    # to a definite loss, but they require more than the open count to
+    # identify.
+    # Conversely, when the leaf utility comes from a node where the other
+    # player chooses, this results in preferring moves that result in the most
+    # options for yourself for any given leaf node.
     # Since the parent of this state defines which player is evaluating this
-    # choice, board._MAX_turn is True when MIN is determining whether to move
-    # to this leaf, so smaller util values are preferred by MIN, and vice versa.
-    return util if board._MAX_turn else -util
+    # choice, it is MAX's turn when MIN is determining whether to move to this
+    # leaf, so smaller values are preferred by MIN, and vice versa.
+    return penalty if cnt == 1 else cnt
+
+# Return an iterable of the utilities that the successors of a state would
+# have as leaf nodes, without creating them, where the state has the open
+# squares in open_bb and MAX_turn, the successors are reached by playing each
+# flat index in indices (which must be open), and masks and penalty are those
+# of the state's board size (see neighbor_masks() and
+# ObstructionBoard.create()).
+# If batch is true (which the caller should only request if it will use every
+# utility), NumPy is installed, and the board fits in 64 bits, the open squares
+# of all of the successors are counted in one vectorized batch. Otherwise, the
+# utilities are generated one at a time through the _leaf_eval() cache, so a
+# caller that stops early (e.g., because of a cutoff) does not evaluate the
+# remaining successors.
+def leaf_utilities(open_bb, MAX_turn, indices, masks, penalty, batch):
+    # Each successor's utility is its _leaf_eval() value, negated if it is
+    # MIN's turn there (i.e., if it is MAX's turn in the state).
+    sign = -1 if MAX_turn else 1
+    if not batch or np is None or len(masks) > 64: # len(masks): square count
+        return (
+            sign * _leaf_eval(open_bb & ~masks[idx], penalty)
+            for idx in indices
+        )
+    
+    cnts = np.bitwise_count(
+        np.uint64(open_bb) &
+        ~np.array([masks[idx] for idx in indices], dtype=np.uint64)
+    )
+    return [
+        sign * (value if value else -inf) # No open squares: terminal
+        for value in np.where(cnts == 1, penalty, cnts).tolist()
+    ]
 
 
 # To use this class, call create(width, height) to build an initial state, and
@@ -36,13 +214,24 @@ def _evaluate_node(board):
 #       str constructor
 #   New board with another move played:
 #       place(row, col)
+#       place_flat(idx) (unchecked; bit idx of open_bb must be set)
 #   Read-only properties:
-#       width, height, MAX_turn, action, done, winner
+#       width, height, MAX_turn, action, done, winner, key, open_bb
+#   Conversion of flat indices between this board and its key's orientation:
+#       to_key_index(idx), from_key_index(idx)
 #   Read/write property:
 #       utility
 #   Unmanaged read/write variable:
 #       chosen_child (expected to be a game tree node, not a bare state)
 class ObstructionBoard:
+    # One board is created for each expanded node, so use slots instead of a
+    # per-instance __dict__.
+    __slots__ = (
+        "_max_bb", "_min_bb", "_blocked_bb", "_open_bb", "_width", "_height",
+        "_penalty", "_tables", "_open_cnt", "_MAX_turn", "_hashes", "_hash",
+        "_sym", "_action", "_utility", "chosen_child"
+    )
+
     # Create a new width x height game board, with no moves played and all
     # squares initially open.
     # This function allows the constructor to be reserved for internally
@@ -51,15 +240,33 @@ class ObstructionBoard:
     def create(cls, width, height):
         return None if width < 1 or height < 1 else\
                cls(
-                   [[OPEN] * width for _ in range(height)], # All open squares
-                   width * height, True, None
+                   0, 0, 0, (1 << (width * height)) - 1, # All open squares
+                   width, height, width * height + 1, # Penalty (see utility)
+                   _board_tables(width, height), True, None,
+                   (0,) * len(_symmetries(width, height))
                )
 
-    def __init__(self, tiles, open_cnt, MAX_turn, action):
+    def __init__(self, max_bb, min_bb, blocked_bb, open_bb, width, height,
+                 penalty, tables, MAX_turn, action, hashes):
         # State-related data
-        self._tiles = tiles # 2D list of the board's squares
-        self._open_cnt = open_cnt # Number of remaining open squares
+        # Bitboards of the squares holding MAX's and MIN's markers, blocked
+        # squares, and open squares (open_bb is the complement of the others
+        # within the board and is stored to avoid recomputing it)
+        self._max_bb = max_bb
+        self._min_bb = min_bb
+        self._blocked_bb = blocked_bb
+        self._open_bb = open_bb
+        self._width = width
+        self._height = height
+        self._penalty = penalty # Leaf utility magnitude for 1 open square
+        self._tables = tables # Shared per-size tables (see _board_tables())
+        self._open_cnt = open_bb.bit_count() # Number of remaining open squares
         self._MAX_turn = MAX_turn
+        # Zobrist hashes of the squares and turn under each symmetry, the
+        # smallest of these (the key), and the index of its symmetry
+        self._hashes = hashes
+        self._hash = min(hashes)
+        self._sym = hashes.index(self._hash)
 
         # AI choice data
         self._action = action # Move made to reach this state
@@ -69,18 +276,31 @@ class ObstructionBoard:
     # Construct a string showing the board as a 2D grid with numbered rows and
     # columns.
     def __str__(self):
-        return "  " + " ".join([str(i) for i in range(self.width)]) + "\n" \
+        squares = [
+            MAX if self._max_bb >> i & 1 else MIN if self._min_bb >> i & 1 else
+            BLOCKED if self._blocked_bb >> i & 1 else OPEN
+            for i in range(self._width * self._height)
+        ]
+        width = self._width
+        return "  " + " ".join([str(i) for i in range(width)]) + "\n" \
                + "\n".join([
-                   f"{i} " + " ".join(row) for i, row in enumerate(self._tiles)
+                   f"{i} " + " ".join(squares[i * width:(i + 1) * width])
+                   for i in range(self._height)
                ])
     
-    # Note that list equality checks element equality.
     # Only the square values need to be compared because this comparison is
     # used only for boards within the same game (which must give the next
     # turn to the same player if the same number of moves have been played
     # because the same player started).
     def __eq__(self, other):
-        return self._tiles == other._tiles
+        return self._max_bb == other._max_bb and \
+               self._min_bb == other._min_bb and \
+               self._blocked_bb == other._blocked_bb
+
+    def __hash__(self):
+        return hash(
+            (self._max_bb, self._min_bb, self._blocked_bb, self._MAX_turn)
+        )
 
 
     # Successor states
@@ -92,42 +312,72 @@ class ObstructionBoard:
         # The valid rows are [0, height - 1], and the valid columns are
         # [0, width - 1].
         # Only open squares can be played.
-        if not (0 <= row < self.height) or not (0 <= col < self.width) \
-           or self._tiles[row][col] != OPEN:
+        width = self._width
+        if not (0 <= row < self._height) or not (0 <= col < width) \
+           or not self._open_bb >> (row * width + col) & 1:
             return None
         
-        # Copy the old board as a new 2D list (shallow copy each row; note that
-        # str is immutable).
-        new_squares = [list(old_row) for old_row in self._tiles]
-        new_open_cnt = self._open_cnt
-
-        # Place the current player's marker in the specified square.
-        new_squares[row][col] = MAX if self._MAX_turn else MIN
-        new_open_cnt -= 1
-
-        # Block all open surrounding tiles
-        for i in range(row - 1, row + 2):
-            if 0 <= i < self.height: # Skip out of range rows
-                for j in range(col - 1, col + 2):
-                    if 0 <= j < self.width and new_squares[i][j] == OPEN:
-                        new_squares[i][j] = BLOCKED
-                        new_open_cnt -= 1
+        return self.place_flat(row * width + col)
+
+    # Play the open square at flat index idx (row * width + col) as in place(),
+    # but without validating the move. This is used by the search, which only
+    # plays squares that are set in open_bb.
+    def place_flat(self, idx):
+        masks, sym_keys, _, _ = self._tables
+        bit = 1 << idx
+
+        # Place the current player's marker in the specified square, and block
+        # all open surrounding tiles.
+        max_bb, min_bb = self._max_bb, self._min_bb
+        if self._MAX_turn:
+            max_bb |= bit
+        else:
+            min_bb |= bit
+        blocked = masks[idx] & self._open_bb & ~bit
+        new_open_bb = self._open_bb & ~blocked & ~bit
+
+        # Update the hashes for the changed squares only (as moved by each
+        # symmetry), and switch whose turn it is.
+        marker_key = _MAX_KEY if self._MAX_turn else _MIN_KEY
+        blocked_indices = list(_bits(blocked))
+        new_hashes = []
+        for new_hash, keys in zip(self._hashes, sym_keys):
+            new_hash ^= _ZOBRIST_TURN ^ keys[idx][marker_key]
+            for i in blocked_indices:
+                new_hash ^= keys[i][_BLOCKED_KEY]
+            new_hashes.append(new_hash)
         
         # Create a new board with the new state, and switch whose turn it is.
         return ObstructionBoard(
-            new_squares, new_open_cnt, not self._MAX_turn, (row, col)
+            max_bb, min_bb, self._blocked_bb | blocked, new_open_bb,
+            self._width, self._height, self._penalty, self._tables,
+            not self._MAX_turn, divmod(idx, self._width), tuple(new_hashes)
         )
 
 
+    # Symmetry
+
+    # Return the flat index that idx on this board corresponds to on the
+    # symmetric board that key is the hash of. Moves stored with a key should
+    # be converted with this so that they are valid for all boards sharing it.
+    def to_key_index(self, idx):
+        return self._tables[2][self._sym][idx]
+
+    # Return the flat index on this board that idx on the symmetric board that
+    # key is the hash of corresponds to (the inverse of to_key_index()).
+    def from_key_index(self, idx):
+        return self._tables[3][self._sym][idx]
+
+
     # Properties
 
     @property
     def width(self):
-        return len(self._tiles[0]) # Column count
+        return self._width # Column count
     
     @property
     def height(self):
-        return len(self._tiles) # Row count
+        return self._height # Row count
 
     @property
     def MAX_turn(self):
@@ -138,6 +388,18 @@ class ObstructionBoard:
     def action(self): 
         return self._action
 
+    # The Zobrist hash of this state, which is equal for equal or symmetric
+    # boards and is used to identify transpositions during search
+    @property
+    def key(self):
+        return self._hash
+
+    # The bitboard of the open squares, where bit row * width + col is set if
+    # the square at (row, col) is open
+    @property
+    def open_bb(self):
+        return self._open_bb
+
     # Whether this is a terminal state and the game is over
     @property
     def done(self):
@@ -157,12 +419,8 @@ class ObstructionBoard:
         # If the utility is accessed but has not been externally provided, the
         # utility is calculated as a terminal node or non-terminal leaf node.
         if self._utility is None:
-            # The utility value of a leaf node is infinity if MAX won,
-            # -infinity if MIN won, and the value of the evaluation function if
-            # no one has won.
-            winner = self.winner
-            self._utility = _evaluate_node(self) if winner is None else \
-                            inf if winner == MAX else -inf
+            util = _leaf_eval(self._open_bb, self._penalty)
+            self._utility = util if self._MAX_turn else -util
         
         return self._utility
     
@@ -1,136 +1,382 @@
 # Note: Instead of generating the entire tree down to the specified depth and
 # then searching, this module generates the tree while searching. This does not
-# allow sorting for Alpha-Beta Pruning, but it does prevent pruned branches
-# from being generated in the first place.
+# allow sorting children by their own utility for Alpha-Beta Pruning, but it
+# does prevent pruned branches from being generated in the first place. Moves
+# are instead ordered by the results of earlier searches (see the move ordering
+# section below).
 
+from collections import defaultdict
+from functools import lru_cache
 from math import inf
 
+from Board import leaf_utilities, neighbor_masks
 
-# Node management during search
 
-# The data for a given node in MM search. This is not included in the game tree
-# itself and is discarded when the search finishes this subtree.
+# Search parameters
+
+# The parameters of an MM search: the depth to search the root state to. MM
+# searches with an unbounded window and never prunes, so its results are always
+# exact.
 class MMData:
+    __slots__ = ("depth",)
+
+    alpha = -inf
+    beta = inf
+    prunes = False
+
     def __init__(self, depth):
         self.depth = depth
-    
-    def child(self): # Decrease the remaining depth for the child
-        return MMData(self.depth - 1)
-    
-    def update_alpha(self, _): # MM has no alpha
-        pass
 
-    def update_beta(self, _): # MM has no beta
-        pass
+# The parameters of an AB search: the depth to search the root state to and the
+# root's alpha and beta values
+class ABData:
+    __slots__ = ("depth", "alpha", "beta")
 
-    def prune(self): # No pruning for MM
-        return False
+    prunes = True
 
-# The data for a given node in AB search
-class ABData:
     def __init__(self, depth, alpha, beta):
         self.depth = depth
         self.alpha = alpha
         self.beta = beta
 
-    def child(self): # Decrease the remaining depth and keep alpha and beta
-        return ABData(self.depth - 1, self.alpha, self.beta)
 
-    def update_alpha(self, new_utility): # Update alpha if larger value found
-        if new_utility > self.alpha:
-            self.alpha = new_utility
+# Transposition table
+
+# Maps an ObstructionBoard.key to a (depth, utility, flag, action) tuple for
+# the last search of that state, where depth is the remaining depth it was
+# searched with, flag tells whether utility is exact or only a bound (because
+# the search of that state was cut off by alpha or beta), and action is the
+# flat index of the move to the best child found. Since symmetric states share
+# a key, action is stored as converted by ObstructionBoard.to_key_index().
+# The table is cleared at the start of each top-level search. Within one
+# search, a state is only ever reached after the same number of moves, so an
+# entry's depth never exceeds the depth of a later visit and heuristic values
+# from different lookahead parities are never mixed (see Readme.txt).
+_TRANSPOSITIONS = {}
+
+_EXACT = 0
+_LOWER = 1 # The utility is at least the stored value
+_UPPER = 2 # The utility is at most the stored value
+
+
+# Move ordering
+
+# Maps a move (as a flat index) to a score that grows each time the move is the
+# best move or causes a cutoff at some node, weighted toward nodes with more
+# remaining depth. Like the transposition table, this is reset at the start of
+# each top-level search.
+_HISTORY = defaultdict(int)
 
-    def update_beta(self, new_utility): # Update beta if smaller value found
-        if new_utility < self.beta:
-            self.beta = new_utility
+# Order the legal moves from a state (in row-major order) so that the best move
+# previously found for the state (if any) is tried first, followed by the other
+# moves from the highest to lowest history score. Ties keep their row-major
+# order.
+def _ordered_moves(moves, hash_move):
+    moves.sort(key=_HISTORY.__getitem__, reverse=True)
+    if hash_move is not None:
+        moves.remove(hash_move)
+        moves.insert(0, hash_move)
+    return moves
 
-    def prune(self): # Prune if alpha and beta cross
-        return self.alpha >= self.beta
+# Reset the tables shared across the nodes of a search.
+def _start_search():
+    _TRANSPOSITIONS.clear()
+    _HISTORY.clear()
 
 
 # Search algorithms
 
 # Explanation of node_data:
 #       node_data is an instance of either MMData or ABData from the top of
-#           this file.
-#       None of the data in a child's node_data is read by the parent (i.e., it
-#           is only passed down the tree). 
-#       For Minimax, node_data contains only the depth/number of remaining
-#           turns along the path. For Minimax with Alpha-Beta Pruning,
-#           node_data contains the depth and the alpha and beta values from the
-#           parent and may be updated while the current call is running.
-#       node_data also includes the child() method to copy itself for recursive
-#           calls and the update_alpha(), update_beta(), and prune() methods
-#           for optional pruning functionality. Since child() returns an
-#           instance of the same class, the original pruning methods are
-#           propagated to the recursive calls.
-def _base_minimax(state, node_data):
-    node = [state]
-    total_expanded = 1 # Count each new state as an expanded node
-
-    # If the state's children should be evaluated...
-    if node_data.depth != 0 and not state.done:
-        # Choose the max child and (for AB) update alpha for MAX; choose the
-        # min child and (for AB) update beta for MIN.
-        state.utility, max_or_min, update_ab = \
-            (-inf, max, node_data.update_alpha) if state.MAX_turn else \
-            (inf, min, node_data.update_beta)
-
-        # For each valid move, repeat this algorithm for the resulting child,
-        # add the produced tree as a subtree, and tally the number of expanded
-        # nodes.
-        # If the rest of the branches should be pruned, both loops exit.
-        for i in range(state.height):
-            for j in range(state.width):
-                new_state = state.place(i, j)
-
-                if new_state is not None:
-                    # Repeat the algorithm for the child.
-                    # If depth reaches 0 or new_state is a terminal node, this
-                    # code will not run for the child, so the child's utility
-                    # will be automatically generated with terminal utility or
-                    # with the evaluation function. Otherwise, this code in the
-                    # recursive call will determine the child's utility based
-                    # on its own children.
-                    child, expanded = _base_minimax(new_state, node_data.child())
-                    node.append(child)
-                    total_expanded += expanded
-
-                    # If a new max/min is found (or no states have been checked
-                    # yet), update the utility and possibly alpha or beta.
-                    temp = max_or_min(state.utility, new_state.utility)
-                    if temp != state.utility or state.chosen_child is None:
-                        state.chosen_child = child # Track the AI's choice
-                        state.utility = temp # New max/min
-
-                        update_ab(temp) # Possible new alpha/beta (update node_state)
-                        if (node_data.prune()): # Prune if alpha >= beta for AB
-                            # If the AI's choice does not lead to a terminal
-                            # state, the AI is not guaranteed to choose the
-                            # child with the best utility if the human's
-                            # choices lead here because not all children were
-                            # evaluated. This requires running the search again
-                            # to stay true to the heuristic.
-                            #
-                            # Pruning can occur at the root node only if a win
-                            # state is found (since alpha and beta start at
-                            # +-infinity), so chosen_child is not reset to None
-                            # in these cases to ensure chosen_child is never
-                            # None for the root when there is a legal move
-                            # (i.e., if the root is not a terminal state).
-                            if state.utility not in (inf, -inf):
-                                state.chosen_child = None # Signal new search needed
-                            break
-            else: # Not pruned yet: continue expanding (skip the break statement)
+#           this file and describes the search from the root: the depth, the
+#           starting alpha and beta values, and whether the search prunes.
+#       The data for each other node (its remaining depth and its alpha and
+#           beta values, which may be narrowed while its children are
+#           searched) is kept in the node's _Frame instead of in a separate
+#           object per node. A child starts with one less remaining depth than
+#           its parent and with its parent's current alpha and beta values.
+#       For Minimax, alpha and beta stay at -infinity and infinity, so they are
+#           only used to classify results for the transposition table.
+
+# The search is depth-first, but instead of recursing, it keeps a stack of
+# _Frame objects for the nodes whose children are still being searched, since
+# Python function calls are expensive.
+class _Frame:
+    __slots__ = (
+        "state", "node", "moves", "move", "best_action", "depth", "alpha",
+        "beta", "window", "MAX_turn"
+    )
+
+    def __init__(self, state, node, moves, depth, alpha, beta, window):
+        self.state = state
+        self.node = node # The game tree node being built for state
+        self.moves = moves # Iterator over the moves that have not been tried
+        self.move = None # The move whose child is being searched
+        self.best_action = None
+        self.depth = depth # Remaining depth
+
+        # The current alpha and beta values, and the (alpha, beta) window the
+        # node was entered with, for classifying the result
+        self.alpha = alpha
+        self.beta = beta
+        self.window = window
+
+        # Choose the max child for MAX and the min child for MIN.
+        self.MAX_turn = state.MAX_turn
+        state.utility = -inf if self.MAX_turn else inf
+
+# Back up the utility of child (a game tree node reached by frame.move) to
+# frame's state, where prunes is whether the search prunes. Return whether the
+# rest of frame's children should be pruned.
+def _update(frame, child, prunes):
+    # If a new max/min is found (or no states have been checked yet), update
+    # the utility and possibly alpha or beta.
+    state, MAX_turn = frame.state, frame.MAX_turn
+    utility = child[0].utility
+    if frame.best_action is None or \
+       (utility > state.utility if MAX_turn else utility < state.utility):
+        state.chosen_child = child # Track the AI's choice
+        state.utility = utility # New max/min
+        frame.best_action = frame.move
+
+        if not prunes: # No alpha, beta, or pruning for MM
+            return False
+
+        # Possible new alpha for MAX or beta for MIN
+        if MAX_turn:
+            if utility > frame.alpha:
+                frame.alpha = utility
+        elif utility < frame.beta:
+            frame.beta = utility
+
+        if frame.alpha >= frame.beta: # Prune if alpha and beta cross
+            # If the AI's choice does not lead to a terminal state, the AI is
+            # not guaranteed to choose the child with the best utility if the
+            # human's choices lead here because not all children were
+            # evaluated. This requires running the search again to stay true
+            # to the heuristic.
+            #
+            # Pruning can occur at the root node only if a win state is found
+            # (since alpha and beta start at +-infinity), so chosen_child is
+            # not reset to None in these cases to ensure chosen_child is never
+            # None for the root when there is a legal move (i.e., if the root
+            # is not a terminal state).
+            if state.utility not in (inf, -inf):
+                state.chosen_child = None # Signal new search needed
+            return True
+    
+    return False
+
+# Record the result of searching state's children to depth, where best_action
+# was the best move (or the move causing a cutoff), and alpha and beta were
+# the original window.
+def _record(state, depth, best_action, alpha, beta):
+    # The best move is likely to be good in sibling positions too.
+    _HISTORY[best_action] += 1 << depth
+
+    # Record the result, which is only a bound if it fell outside the original
+    # window.
+    flag = _UPPER if state.utility <= alpha else \
+           _LOWER if state.utility >= beta else _EXACT
+    _TRANSPOSITIONS[state.key] = \
+        (depth, state.utility, flag, state.to_key_index(best_action))
+
+# Record the result of a node whose children are done or pruned.
+def _finish(frame):
+    _record(frame.state, frame.depth, frame.best_action, *frame.window)
+
+# Search the children of a node with 1 remaining depth, which are all leaves,
+# given the utilities of the children reached by each of moves (which are
+# evaluated by Board.leaf_utilities() instead of creating a board for each).
+# The children are checked in the order of moves and pruned at the same point
+# as in the main search, but only the chosen child is created.
+# alpha and beta are the node's current values, window is the window it was
+# entered with, and prunes is whether the search prunes (see _Frame and
+# _update()).
+# Return the chosen child's game tree node and the number of children that were
+# checked.
+def _collect_and_evaluate_leaves(state, moves, utilities, alpha, beta, window,
+                                 prunes):
+    MAX_turn = state.MAX_turn
+    best, checked, pruned = None, 0, False
+    for utility in utilities:
+        checked += 1
+        if best is None or \
+           (utility > state.utility if MAX_turn else utility < state.utility):
+            best = checked - 1
+            state.utility = utility # New max/min
+            if not prunes:
                 continue
 
-            break # Pruned: exit both loops immediately
+            # Possible new alpha for MAX or beta for MIN
+            if MAX_turn:
+                if utility > alpha:
+                    alpha = utility
+            elif utility < beta:
+                beta = utility
+
+            if alpha >= beta: # Prune if alpha and beta cross
+                pruned = True
+                break
+    
+    # As in _update(), chosen_child is None if the node was pruned without
+    # finding a terminal state.
+    child = [state.place_flat(moves[best])]
+    if not pruned or state.utility in (inf, -inf):
+        state.chosen_child = child # Track the AI's choice
+
+    _record(state, 1, moves[best], *window)
+    return child, checked
+
+# Build the search function for width x height boards, which searches from a
+# state with the given node_data (see above) and returns the game tree and the
+# number of expanded nodes.
+# The board size is constant during a search, so the size-dependent values are
+# computed once here and bound as closure variables of the search instead of
+# being looked up from each state. The functions are cached by size.
+@lru_cache(maxsize=None)
+def make_search(width, height):
+    cells = tuple((idx, 1 << idx) for idx in range(width * height))
+    masks = neighbor_masks(width, height)
+    penalty = width * height + 1
+
+    # Start searching state with the given remaining depth and alpha and beta
+    # values, returning its game tree node, a new _Frame for it if its
+    # children must be searched (or None if its utility is already known),
+    # and the number of its children that were expanded while entering it.
+    def enter(state, depth, alpha, beta, prunes):
+        node = [state]
+
+        # If depth reaches 0 or state is a terminal node, its children are
+        # not searched, so its utility will be automatically generated with
+        # terminal utility or with the evaluation function.
+        if depth == 0 or state.done:
+            return node, None, 0
+
+        # If this state has already been searched at least as deep, reuse its
+        # utility if it is exact or a bound outside the window, or otherwise
+        # use the bound to narrow the window (for AB).
+        window = (alpha, beta)
+        entry = _TRANSPOSITIONS.get(state.key)
+        hash_move = None if entry is None else state.from_key_index(entry[3])
+        if entry is not None and entry[0] >= depth:
+            _, utility, flag, _ = entry
+            if prunes:
+                if flag == _LOWER and utility > alpha:
+                    alpha = utility
+                elif flag == _UPPER and utility < beta:
+                    beta = utility
 
-    return node, total_expanded
+            if flag == _EXACT or alpha >= beta or \
+               (flag == _LOWER and utility >= window[1]) or \
+               (flag == _UPPER and utility <= window[0]):
+                state.utility = utility # chosen_child stays None (_update)
+                return node, None, 0
 
-def minimax(state, depth):
-    return _base_minimax(state, MMData(depth))
+        # Otherwise, the utility is determined by the children. Moves that
+        # were good elsewhere are tried first so that alpha and beta narrow
+        # sooner.
+        open_bb = state.open_bb
+        moves = _ordered_moves(
+            [idx for idx, bit in cells if open_bb & bit], hash_move
+        )
+        if depth == 1:
+            # Without pruning, every leaf is checked, so they can be evaluated
+            # in one batch.
+            utilities = leaf_utilities(
+                open_bb, state.MAX_turn, moves, masks, penalty, not prunes
+            )
+            child, expanded = _collect_and_evaluate_leaves(
+                state, moves, utilities, alpha, beta, window, prunes
+            )
+            node.append(child)
+            return node, None, expanded
+    
+        frame = _Frame(state, node, iter(moves), depth, alpha, beta, window)
+        return node, frame, 0
+
+    def search(state, node_data):
+        prunes = node_data.prunes
+        node, frame, expanded = enter(
+            state, node_data.depth, node_data.alpha, node_data.beta, prunes
+        )
+        total_expanded = 1 + expanded # Count each new state as expanded
+        if frame is None:
+            return node, total_expanded
+
+        stack = [frame]
+        while True:
+            # For each valid move, add the child's tree as a subtree, and
+            # tally the child as an expanded node. If the child's utility is
+            # not yet known, search its children before continuing with this
+            # node's.
+            frame = stack[-1]
+            frame.move = next(frame.moves, None)
+            if frame.move is not None:
+                child, child_frame, expanded = enter(
+                    frame.state.place_flat(frame.move), frame.depth - 1,
+                    frame.alpha, frame.beta, prunes
+                )
+                frame.node.append(child)
+                total_expanded += 1 + expanded
+
+                if child_frame is not None:
+                    stack.append(child_frame)
+                    continue
+                done = _update(frame, child, prunes)
+            else:
+                done = True # No moves remain
+
+            # Once a node's children are done or pruned, back up its utility
+            # to its parent, which may in turn be done.
+            while done:
+                _finish(stack.pop())
+                if not stack:
+                    return frame.node, total_expanded
+            
+                child = frame.node
+                frame = stack[-1]
+                done = _update(frame, child, prunes)
+
+    return search
 
-def minimax_ab(state, depth):
-    # Alpha starts at -inf; beta starts at inf
-    return _base_minimax(state, ABData(depth, -inf, inf))
\ No newline at end of file
+# If search is not provided, the search for the state's board size is used.
+def minimax(state, depth, search=None):
+    if search is None:
+        search = make_search(state.width, state.height)
+    
+    _start_search()
+    return search(state, MMData(depth))
+
+# AB search uses iterative deepening: the state is searched to increasing
+# depths up to the requested depth, and only the tree from the last search is
+# kept. The transposition and history tables persist between iterations, so
+# each search tries the best moves of the previous, shallower one first, which
+# usually prunes enough to more than pay for the repeated shallow searches.
+# Only depths with the same parity as the requested depth are searched because
+# the meaning of the leaf utilities flips between odd and even depths (see
+# Readme.txt), so the best moves at the other parity are poor guesses. Once a
+# search reaches at least as many moves as there are open squares, every leaf
+# is terminal, so deeper searches would give the same result and are skipped.
+# The expanded count includes the nodes expanded in every iteration.
+def minimax_ab(state, depth, search=None):
+    if search is None:
+        search = make_search(state.width, state.height)
+
+    _start_search()
+    tree, total_expanded = None, 0
+    open_cnt = state.open_bb.bit_count()
+    depths = range(2 - depth % 2, depth + 1, 2) if depth else (0,)
+    for d in depths:
+        # Discard the previous iteration's result for the root so that it is
+        # backed up from the new search instead.
+        state.utility = None
+        state.chosen_child = None
+
+        # Alpha starts at -inf; beta starts at inf
+        tree, expanded = search(state, ABData(d, -inf, inf))
+        total_expanded += expanded
+        if d >= open_cnt: # The game was searched to the end
+            break
+    
+    return tree, total_expanded
\ No newline at end of file
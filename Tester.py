@@ -11,16 +11,19 @@ from inspect import cleandoc
 import sys
 
 from Board import ObstructionBoard
-from Solver import minimax, minimax_ab
+from Solver import make_search, minimax, minimax_ab
 
 
 # Utility constants
 _LOOKAHEAD_DEPTH = 4
 
 _README = "Readme.txt"
+# Each entry builds the algorithm from the search for the chosen board size
 _ALGORITHMS = {
-    "MM": lambda state: minimax(state, _LOOKAHEAD_DEPTH),
-    "AB": lambda state: minimax_ab(state, _LOOKAHEAD_DEPTH)
+    "MM": lambda search:
+        lambda state: minimax(state, _LOOKAHEAD_DEPTH, search),
+    "AB": lambda search:
+        lambda state: minimax_ab(state, _LOOKAHEAD_DEPTH, search)
 }
 _SIZES = [(6, 6), (6, 7), (7, 8), (8, 8)]
 _SIZE_STRINGS = [f'{size[0]}*{size[1]}' for size in _SIZES]
@@ -49,7 +52,7 @@ def _parse_args():
     # 2. Search method
     algorithm_name = sys.argv[2]
     try:
-        algorithm = _ALGORITHMS[algorithm_name]
+        make_algorithm = _ALGORITHMS[algorithm_name]
     except KeyError:
         raise ValueError(
             f'"{algorithm_name}" is not a supported algorithm. Choose one of '
@@ -65,6 +68,9 @@ def _parse_args():
         )
     size = _SIZES[size_ind]
 
+    # Specialize the search for the board size.
+    algorithm = make_algorithm(make_search(*size))
+
     return ai_first, algorithm, algorithm_name, size, sys.argv[3]
 
 
@@ -99,7 +105,7 @@ def _play_ai_turn(tree, search): # Returns node
     # utility of all legal successors).
     # tree[0].done is guaranteed to be false by the loop condition, so the AI
     # must have some move at this state, so search(tree[0])[0].chosen_child is
-    # not None (see the pruning section of _base_minimax() in Solver.py for how
+    # not None (see the pruning section of _update() in Solver.py for how
     # this is guaranteed).
     if temp_tree is None:
         return search(tree[0])[0].chosen_child
@@ -142,12 +148,12 @@ def _get_human_move(tree): # Returns state
     
     return move # User has chosen a valid move
 
-def _find_child(tree, state): # Returns node
-    for ind in range(1, len(tree)):
-        if state == tree[ind][0]:
-            return tree[ind]
-    
-    return None
+# Each child of a tree node is reached by a different move, so children are
+# found by their action instead of by comparing boards.
+def _find_child(tree, action): # Returns node
+    return next(
+        (child for child in tree[1:] if child[0].action == action), None
+    )
 
 def _play_human_turn(tree): # Returns node
     # Get a valid move from the user (one must exist because tree[0].done is
@@ -158,7 +164,7 @@ def _play_human_turn(tree): # Returns node
     
     # Select the chosen move from the tree if it exists in the tree. Otherwise,
     # generate more of the tree, rooted at the chosen state.
-    temp_tree = _find_child(tree, move_state)
+    temp_tree = _find_child(tree, move_state.action)
     if temp_tree is None: # Parent was leaf or partially pruned.
         return [move_state] # On the AI's turn, it will generate more if needed
     return temp_tree # Requested node exists; advance to it.
@@ -179,12 +185,16 @@ def _show_move(tree, ai_turn):
 #           loop), a value of None for chosen_child indicates the tree has not
 #           been sufficiently generated past this point due to depth limits or
 #           pruning.
-#       2. tree[x], for some 1 < x < len(tree) - 1
-#           This retrieves a child node by its 1-based index (0 is the root
-#           state). For the human turn, this occurs in _find_child(), where
-#           None indicates that the state is not in the tree, and if
-#           the state is known to be valid, the tree simply has not been
-#           generated to this point.
+#       2. tree[1:]
+#           These are the child nodes (tree[0] is the root state). For the
+#           human turn, _find_child() finds the child reached by the human's
+#           move, where None indicates that the state is not in the tree, and
+#           if the state is known to be valid, the tree simply has not been
+#           generated to this point. A node one move above the depth limit
+#           has only its chosen child (a leaf) in the tree because the other
+#           leaves are evaluated without creating them, but the AI must
+#           search again after any move from such a node anyway because
+#           leaves have no chosen_child.
 def play(ai_first, search, first_tree):
     tree = first_tree
     ai_turn = ai_first
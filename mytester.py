@@ -9,23 +9,15 @@ print(tree[0].chosen_child[0].action)
 print(tree[0].utility)
 print()
 
+# Visit every board in the tree once (a tree node is a list holding its board
+# followed by its child nodes).
 positive = []
 negative = []
-for node in tree:
+stack = [tree]
+while stack:
+    node = stack.pop()
     if isinstance(node, list):
-        for node1 in tree:
-            if isinstance(node1, list):
-                for node2 in tree:
-                    if isinstance(node2, list):
-                        for node3 in tree:
-                            if isinstance(node3, list):
-                                pass
-                            else:
-                                (positive if node3.utility > 0 else negative).append(node3.utility)
-                    else:
-                        (positive if node2.utility > 0 else negative).append(node2.utility)
-            else:
-                (positive if node1.utility > 0 else negative).append(node1.utility)
+        stack.extend(node)
     else:
         (positive if node.utility > 0 else negative).append(node.utility)
 